@@ -1 +1,3 @@
 from .backtester import Backtester
+from . import analytics
+from .costs import CostModel, FeeSchedule, FixedSlippage, VolatilitySlippage, DepthSlippage, FundingSchedule
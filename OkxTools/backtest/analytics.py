@@ -0,0 +1,354 @@
+import numpy as np
+import pandas as pd
+
+# 按秒计的一年，用于从时间戳推断年化周期数
+SECONDS_PER_YEAR = 365 * 24 * 60 * 60
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+class EquityCurve:
+    """
+    权益曲线，按 NumPy 数组分段存储；按下标或迭代访问时才生成 {'timestamp', 'balance'} 字典
+    """
+
+    def __init__(self):
+        self._timestamps = []
+        self._balances = []
+        self._length = 0
+
+    def extend(self, timestamps, balances):
+        """
+        追加一段权益记录
+        :param timestamps: 时间戳数组（秒）
+        :param balances: 权益数组
+        """
+        self._timestamps.append(np.asarray(timestamps, dtype=np.float64))
+        self._balances.append(np.asarray(balances, dtype=np.float64))
+        self._length += len(self._balances[-1])
+
+    def to_arrays(self):
+        """
+        :return: (timestamps, balances)，只有一段时不复制
+        """
+        if not self._balances:
+            empty = np.empty(0, dtype=np.float64)
+            return empty, empty
+        if len(self._balances) == 1:
+            return self._timestamps[0], self._balances[0]
+        return np.concatenate(self._timestamps), np.concatenate(self._balances)
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        timestamps, balances = self.to_arrays()
+        if isinstance(index, slice):
+            return [{'timestamp': float(t), 'balance': float(b)}
+                    for t, b in zip(timestamps[index], balances[index])]
+        return {'timestamp': float(timestamps[index]), 'balance': float(balances[index])}
+
+    def __iter__(self):
+        timestamps, balances = self.to_arrays()
+        for t, b in zip(timestamps.tolist(), balances.tolist()):
+            yield {'timestamp': t, 'balance': b}
+
+
+def equity_to_arrays(equity_curve):
+    """
+    将权益曲线转换为 NumPy 数组
+    :param equity_curve: EquityCurve，或 list[dict]（每项包含 timestamp（秒）和 balance）
+    :return: (timestamps, balances) 两个 float64 数组
+    """
+    if isinstance(equity_curve, EquityCurve):
+        return equity_curve.to_arrays()
+    n = len(equity_curve)
+    timestamps = np.fromiter((p['timestamp'] for p in equity_curve), dtype=np.float64, count=n)
+    balances = np.fromiter((p['balance'] for p in equity_curve), dtype=np.float64, count=n)
+    return timestamps, balances
+
+
+def closed_trades_to_arrays(trades):
+    """
+    从交易记录中取出已平仓交易（SELL）并转换为数组，同时给出尚未平仓的开仓时间
+    :param trades: list[dict] 或 DataFrame, Backtester.trades
+    :return: dict, 包含 entry_time/exit_time（秒）、entry_price、exit_price、size、profit、open_entry_time
+    """
+    df = trades if isinstance(trades, pd.DataFrame) else pd.DataFrame(trades)
+    empty = np.empty(0, dtype=np.float64)
+    result = {k: empty for k in ('entry_time', 'exit_time', 'entry_price', 'exit_price', 'size', 'profit',
+                                 'open_entry_time')}
+    if df.empty or 'type' not in df:
+        return result
+
+    closed = df[df['type'] == 'SELL']
+    if not closed.empty:
+        result.update(_closed_arrays(closed))
+    # 没有对应 SELL 记录的 BUY 即为回测结束时仍持有的仓位
+    opened = to_seconds(df.loc[df['type'] == 'BUY', 'entry_time'])
+    result['open_entry_time'] = opened[~np.isin(opened, result['entry_time'])]
+    return result
+
+
+def _closed_arrays(closed):
+    return {
+        'entry_time': to_seconds(closed['entry_time']),
+        'exit_time': to_seconds(closed['exit_time']),
+        'entry_price': closed['entry_price'].to_numpy(dtype=np.float64),
+        'exit_price': closed['exit_price'].to_numpy(dtype=np.float64),
+        'size': closed['size'].to_numpy(dtype=np.float64),
+        'profit': closed['profit'].to_numpy(dtype=np.float64),
+    }
+
+
+# 数值时间戳的单位换算到秒
+_UNIT_SCALE = {'s': 1.0, 'ms': 1e3, 'us': 1e6, 'ns': 1e9}
+
+
+def to_seconds(values, unit='ms'):
+    """
+    将时间列统一转换为秒级 float64 时间戳
+    :param values: 时间列，datetime 或数值
+    :param unit: 数值时间戳的单位，默认与 OKX 接口和 CSV 一致为毫秒
+    """
+    if pd.api.types.is_numeric_dtype(values):
+        return np.asarray(values, dtype=np.float64) / _UNIT_SCALE[unit]
+    return pd.to_datetime(values).to_numpy(dtype='datetime64[ns]').astype(np.int64) / 1e9
+
+
+def infer_periods_per_year(timestamps):
+    """
+    根据相邻时间戳的中位间隔推断每年的周期数（只取前 10000 个间隔，避免对整条曲线排序）
+    """
+    if len(timestamps) < 2:
+        return 0
+    step = np.median(np.diff(timestamps[:10001]))
+    return SECONDS_PER_YEAR / step if step > 0 else 0
+
+
+def simple_returns(balances):
+    """
+    逐周期收益率
+    """
+    if len(balances) < 2:
+        return np.empty(0, dtype=np.float64)
+    prev = balances[:-1]
+    returns = np.zeros(len(prev), dtype=np.float64)
+    np.divide(balances[1:], prev, out=returns, where=prev != 0)
+    returns -= 1
+    returns[prev == 0] = 0.0
+    return returns
+
+
+def drawdown_series(balances, initial_balance=None):
+    """
+    回撤曲线（相对历史最高点的百分比）
+    :param balances: 权益数组
+    :param initial_balance: 初始资金，作为最初的峰值
+    :return: ndarray, 每个时点的回撤（%）
+    """
+    peak = np.maximum.accumulate(balances)
+    if initial_balance is not None:
+        np.maximum(peak, initial_balance, out=peak)
+    return _drawdown_from_peak(balances, peak)
+
+
+def rolling_drawdown(balances, window):
+    """
+    滚动窗口回撤：相对最近 window 个周期内最高点的回撤（%）
+    """
+    return _drawdown_from_peak(balances, rolling_max(balances, window))
+
+
+def rolling_max(values, window):
+    """
+    滚动最大值（窗口不足时取已有部分），耗时与 window 无关。
+    按 window 分块后分别求块内前缀最大值和后缀最大值，任一窗口恰好横跨相邻两块，
+    其最大值为左块后缀与右块前缀的较大者（van Herk / Gil-Werman 算法）
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    if window <= 1 or n == 0:
+        return values.copy()
+    if window >= n:
+        return np.maximum.accumulate(values)
+    padded = np.concatenate((values, np.full(-n % window, -np.inf))).reshape(-1, window)
+    prefix = np.maximum.accumulate(padded, axis=1).ravel()
+    suffix = np.maximum.accumulate(padded[:, ::-1], axis=1)[:, ::-1].ravel()
+    result = np.empty(n, dtype=np.float64)
+    result[:window - 1] = prefix[:window - 1]
+    np.maximum(suffix[:n - window + 1], prefix[window - 1:n], out=result[window - 1:])
+    return result
+
+
+def _drawdown_from_peak(balances, peak):
+    """
+    (peak - balance) / peak * 100，peak 非正时记为 0
+    """
+    drawdown = np.empty(len(peak), dtype=np.float64)
+    if len(peak) and peak.min() > 0:
+        # 常见情况：权益始终为正，原地计算 (1 - balance / peak) * 100
+        np.divide(balances, peak, out=drawdown)
+        np.subtract(1.0, drawdown, out=drawdown)
+    else:
+        drawdown.fill(0.0)
+        np.subtract(peak, balances, out=drawdown)
+        np.divide(drawdown, peak, out=drawdown, where=peak > 0)
+        drawdown[peak <= 0] = 0.0
+    drawdown *= 100
+    return drawdown
+
+
+def sharpe_ratio(returns, periods_per_year, risk_free_rate=0.0):
+    """
+    年化夏普比率
+    :param risk_free_rate: 年化无风险利率
+    """
+    if len(returns) < 2 or periods_per_year <= 0:
+        return 0.0
+    excess = returns - risk_free_rate / periods_per_year if risk_free_rate else returns
+    n = len(excess)
+    mean = excess.sum() / n
+    # 用一次点积得到平方和，避免 std() 的多次遍历和临时数组
+    variance = max((np.dot(excess, excess) - n * mean * mean) / (n - 1), 0.0)
+    std = np.sqrt(variance)
+    return float(mean / std * np.sqrt(periods_per_year)) if std > 0 else 0.0
+
+
+def sortino_ratio(returns, periods_per_year, risk_free_rate=0.0):
+    """
+    年化索提诺比率，只以下行波动作为风险
+    """
+    if len(returns) < 2 or periods_per_year <= 0:
+        return 0.0
+    excess = returns - risk_free_rate / periods_per_year if risk_free_rate else returns
+    negative = np.minimum(excess, 0.0)
+    downside = np.sqrt(np.dot(negative, negative) / len(negative))
+    return float(excess.mean() / downside * np.sqrt(periods_per_year)) if downside > 0 else 0.0
+
+
+def calmar_ratio(balances, periods_per_year, max_drawdown, initial_balance=None):
+    """
+    卡玛比率：年化收益 / 最大回撤
+    :param max_drawdown: 最大回撤（%）
+    :param initial_balance: 初始资金，默认取 balances[0]
+    """
+    if initial_balance is None:
+        initial_balance = balances[0] if len(balances) else 0.0
+    if len(balances) < 2 or periods_per_year <= 0 or max_drawdown <= 0 or initial_balance <= 0:
+        return 0.0
+    years = (len(balances) - 1) / periods_per_year
+    growth = balances[-1] / initial_balance
+    if growth <= 0:
+        return 0.0
+    annual_return = growth ** (1 / years) - 1
+    return float(annual_return / (max_drawdown / 100))
+
+
+def position_mask(timestamps, entry_times, exit_times, open_entry_times=()):
+    """
+    标记每个时点是否持仓，使用差分数组在 O(n) 内完成
+    :param open_entry_times: 未平仓仓位的开仓时间，视为持有到最后一个时点
+    :return: bool 数组
+    """
+    marks = np.zeros(len(timestamps) + 1, dtype=np.int64)
+    if len(entry_times):
+        start = np.searchsorted(timestamps, entry_times, side='left')
+        end = np.searchsorted(timestamps, exit_times, side='left')
+        np.add.at(marks, start, 1)
+        np.add.at(marks, end, -1)
+    if len(open_entry_times):
+        np.add.at(marks, np.searchsorted(timestamps, open_entry_times, side='left'), 1)
+    return np.cumsum(marks[:-1]) > 0
+
+
+def period_returns(timestamps, balances, freq='D'):
+    """
+    按自然周期统计收益率。timestamps 需按时间升序（权益曲线本身即如此）
+    :param freq: pandas 重采样频率，例如 'D', 'W', 'ME'
+    :return: Series, 索引为周期末时间
+    """
+    if len(balances) == 0:
+        return pd.Series(dtype=np.float64)
+    if _is_intraday(freq):
+        index = pd.DatetimeIndex((timestamps * 1e9).astype('datetime64[ns]'))
+        series = pd.Series(balances, index=index)
+    else:
+        # 日及以上的周期都以 UTC 零点为边界：先用 NumPy 取出每天最后一个点，再对日线数据重采样
+        days = np.floor(timestamps / SECONDS_PER_DAY)
+        last = np.append(np.flatnonzero(days[1:] != days[:-1]), len(days) - 1)
+        index = pd.DatetimeIndex((timestamps[last] * 1e9).astype('datetime64[ns]'))
+        series = pd.Series(balances[last], index=index)
+    closes = series.resample(freq).last().dropna()
+    opens = np.concatenate(([balances[0]], closes.to_numpy()[:-1]))
+    return pd.Series(closes.to_numpy() / opens - 1, index=closes.index)
+
+
+def _is_intraday(freq):
+    """
+    判断重采样频率是否短于一天
+    """
+    try:
+        return pd.tseries.frequencies.to_offset(freq).nanos < SECONDS_PER_DAY * 10 ** 9
+    except ValueError:
+        # 月、周等非固定长度的频率没有 nanos
+        return False
+
+
+def build_report(timestamps, balances, trades=None, initial_balance=None, periods_per_year=None,
+                 risk_free_rate=0.0, drawdown_window=None, duration_bins=10, freq='D'):
+    """
+    基于权益数组和交易记录生成完整绩效报告
+    :param timestamps: 权益时间戳（秒）
+    :param balances: 权益数组
+    :param trades: Backtester.trades 或 closed_trades_to_arrays 的结果
+    :param initial_balance: 初始资金，默认取 balances[0]
+    :param periods_per_year: 年化周期数，默认根据时间戳推断
+    :param risk_free_rate: 年化无风险利率
+    :param drawdown_window: 滚动回撤窗口，None 表示不计算
+    :param duration_bins: 持仓时长直方图的分箱数
+    :param freq: 分周期收益的重采样频率
+    :return: dict
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    balances = np.asarray(balances, dtype=np.float64)
+    if initial_balance is None:
+        initial_balance = float(balances[0]) if len(balances) else 0.0
+    if periods_per_year is None:
+        periods_per_year = infer_periods_per_year(timestamps)
+    if trades is None or not isinstance(trades, dict):
+        trades = closed_trades_to_arrays(trades if trades is not None else [])
+
+    returns = simple_returns(balances)
+    drawdown = drawdown_series(balances, initial_balance)
+    max_drawdown = float(drawdown.max()) if len(drawdown) else 0.0
+    final_balance = float(balances[-1]) if len(balances) else initial_balance
+
+    profit = trades['profit']
+    durations = trades['exit_time'] - trades['entry_time']
+    notional = np.sum(trades['entry_price'] * trades['size']) + np.sum(trades['exit_price'] * trades['size'])
+    mean_equity = balances.mean() if len(balances) else 0.0
+    in_position = position_mask(timestamps, trades['entry_time'], trades['exit_time'],
+                                trades.get('open_entry_time', ()))
+    hist_counts, hist_edges = np.histogram(durations, bins=duration_bins) if len(durations) else (
+        np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64))
+
+    report = {
+        'initial_balance': initial_balance,
+        'final_balance': final_balance,
+        'total_return': (final_balance - initial_balance) / initial_balance * 100 if initial_balance else 0.0,
+        'total_trades': len(profit),
+        'win_rate': float(np.count_nonzero(profit > 0) / len(profit) * 100) if len(profit) else 0.0,
+        'sharpe_ratio': sharpe_ratio(returns, periods_per_year, risk_free_rate),
+        'sortino_ratio': sortino_ratio(returns, periods_per_year, risk_free_rate),
+        'calmar_ratio': calmar_ratio(balances, periods_per_year, max_drawdown, initial_balance),
+        'max_drawdown': max_drawdown,
+        'drawdown': drawdown,
+        'exposure': float(in_position.mean() * 100) if len(in_position) else 0.0,
+        'turnover': float(notional / mean_equity) if mean_equity > 0 else 0.0,
+        'average_trade_duration': float(durations.mean()) if len(durations) else 0.0,
+        'trade_duration_histogram': {'counts': hist_counts, 'bin_edges': hist_edges},
+        'period_returns': period_returns(timestamps, balances, freq),
+    }
+    if drawdown_window:
+        report['rolling_drawdown'] = rolling_drawdown(balances, drawdown_window)
+    return report
@@ -1,21 +1,38 @@
+import time
+
+import numpy as np
+
+from . import analytics
+from ..utils.metrics import REGISTRY
+
+# 回测运行指标
+BACKTEST_RUNS = REGISTRY.counter("backtest_runs_total", "Backtester.run calls")
+BACKTEST_BARS = REGISTRY.counter("backtest_bars_total", "Bars processed by Backtester.run")
+BACKTEST_TRADES = REGISTRY.counter("backtest_trades_total", "Positions closed by Backtester.run")
+BACKTEST_SECONDS = REGISTRY.histogram("backtest_run_seconds", "Backtester.run wall time",
+                                      buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 600, 1800))
+
+
 class Backtester:
     """
     回测框架，支持更复杂的交易信号和风险管理
     """
 
-    def __init__(self, initial_balance=10000, risk_per_trade=0.02, debug_mode=False):
+    def __init__(self, initial_balance=10000, risk_per_trade=0.02, debug_mode=False, cost_model=None):
         """
         初始化回测框架。
         :param initial_balance: 初始资金
         :param risk_per_trade: 每笔交易的风险占总资金的比例
+        :param cost_model: CostModel, 手续费/滑点/资金费模型，None 表示按信号价零成本成交
         """
         self.debug_mode = debug_mode
         self.initial_balance = initial_balance
         self.risk_per_trade = risk_per_trade
+        self.cost_model = cost_model
         self.balance = initial_balance
         self.positions = []
         self.trades = []
-        self.equity_curve = []
+        self.equity_curve = analytics.EquityCurve()
 
     def calculate_position_size(self, stop_loss_distance):
         """
@@ -29,24 +46,36 @@ class Backtester:
         position_size = risk_amount / stop_loss_distance
         return position_size
 
-    def open_position(self, timestamp, signal):
+    def open_position(self, timestamp, signal, bar_index=None):
         """
         开仓操作
         :param timestamp: 交易时间
-        :param signal: 交易信号字典，包含type, price, stop_loss, take_profit等信息
+        :param signal: 交易信号字典，包含type, price, stop_loss, take_profit等信息；
+                       可选 maker（开仓是否挂单成交）、take_profit_maker（止盈是否挂单成交）
+        :param bar_index: 当前 K 线在数据中的位置，供成本模型查表；设置了 cost_model 时必须提供
         """
         if signal['type'] != 'long':  # 目前只支持做多
             return
+        if self.cost_model and bar_index is None:
+            raise ValueError("bar_index is required when a cost_model is set")
 
         stop_loss_distance = abs(signal['price'] - signal['stop_loss'])
         position_size = self.calculate_position_size(stop_loss_distance)
 
         if position_size > 0:
+            entry_price = signal['price']
+            entry_fee = 0
+            if self.cost_model:
+                entry_price = float(self.cost_model.fill_price(bar_index, entry_price, position_size, 1))
+                entry_fee = self.cost_model.fee(entry_price * position_size, bar_index, signal.get('maker', False))
             position = {
                 'entry_time': timestamp,
-                'entry_price': signal['price'],
+                'entry_index': bar_index,
+                'entry_price': entry_price,
+                'entry_fee': entry_fee,
                 'stop_loss': signal['stop_loss'],
                 'take_profit': signal['take_profit'],
+                'take_profit_maker': signal.get('take_profit_maker', False),
                 'size': position_size,
                 'type': signal['type'],
                 'entry_balance': self.balance
@@ -56,21 +85,33 @@ class Backtester:
             # 记录交易
             self.trades.append({
                 'entry_time': timestamp,
-                'entry_price': signal['price'],
+                'entry_price': entry_price,
                 'type': 'BUY',
                 'size': position_size,
+                'fee': entry_fee,
                 'balance': self.balance
             })
 
-    def close_position(self, timestamp, position, current_price, reason='signal'):
+    def close_position(self, timestamp, position, current_price, reason='signal', bar_index=None, maker=False):
         """
         平仓操作
         :param timestamp: 交易时间
         :param position: 持仓信息
         :param current_price: 当前价格
         :param reason: 平仓原因（'signal', 'stop_loss', 'take_profit'）
+        :param bar_index: 当前 K 线在数据中的位置，供成本模型查表；设置了 cost_model 时必须提供
+        :param maker: 平仓是否为挂单成交，决定手续费率
         """
-        profit = (current_price - position['entry_price']) * position['size']
+        if self.cost_model and bar_index is None:
+            raise ValueError("bar_index is required when a cost_model is set")
+        fee = 0
+        funding = 0
+        if self.cost_model:
+            current_price = float(self.cost_model.fill_price(bar_index, current_price, position['size'], -1))
+            fee = position['entry_fee'] + self.cost_model.fee(current_price * position['size'], bar_index, maker)
+            funding = float(self.cost_model.funding_cost(
+                position['entry_index'], bar_index, position['entry_price'] * position['size']))
+        profit = (current_price - position['entry_price']) * position['size'] - fee - funding
         self.balance += profit
 
         # 记录交易
@@ -82,6 +123,8 @@ class Backtester:
             'type': 'SELL',
             'size': position['size'],
             'profit': profit,
+            'fee': fee,
+            'funding': funding,
             'balance': self.balance,
             'reason': reason
         })
@@ -95,19 +138,30 @@ class Backtester:
         :param strategy: 策略实例
         :return: dict, 回测报告
         """
+        start = time.perf_counter()
+        trades_before = len(self.trades)
+        # OKX 接口和 CSV 按时间倒序，回测需按时间正序推进
+        if not data['Timestamp'].is_monotonic_increasing:
+            data = data.sort_values('Timestamp', kind='stable').reset_index(drop=True)
         data = strategy.prepare_data(data)
-        for index, row in data.iterrows():
+        if self.cost_model:
+            self.cost_model.prepare(data)
+        # 权益曲线直接写入数组，避免逐行构造字典
+        equity_timestamps = analytics.to_seconds(data['Timestamp'])
+        equity_balances = np.empty(len(data), dtype=np.float64)
+        for bar_index, (_, row) in enumerate(data.iterrows()):
             timestamp = row['Timestamp']
             # 更新持仓状态
             positions_to_remove = []
             for i, position in enumerate(self.positions):
                 # 检查是否触及止损
                 if row['Close'] <= position['stop_loss']:
-                    self.close_position(timestamp, position, position['stop_loss'], 'stop_loss')
+                    self.close_position(timestamp, position, position['stop_loss'], 'stop_loss', bar_index)
                     positions_to_remove.append(i)
                 # 检查是否触及止盈
                 elif row['Close'] >= position['take_profit']:
-                    self.close_position(timestamp, position, position['take_profit'], 'take_profit')
+                    self.close_position(timestamp, position, position['take_profit'], 'take_profit', bar_index,
+                                        position['take_profit_maker'])
                     positions_to_remove.append(i)
 
             # 移除已平仓的位置
@@ -120,17 +174,25 @@ class Backtester:
                 for signal in signals:
                     if signal['type'] == 'exit' and self.positions:
                         for position in self.positions[:]:
-                            self.close_position(timestamp, position, row['Close'], 'signal')
+                            self.close_position(timestamp, position, row['Close'], 'signal', bar_index,
+                                                signal.get('maker', False))
                         self.positions = []
                     elif signal['type'] == 'long' and not self.positions:
-                        self.open_position(timestamp, signal)
-            # 记录权益曲线
-            self.equity_curve.append({
-                # todo 有问题
-                'timestamp': timestamp.timestamp(),
-                'balance': self.balance
-            })
-
+                        self.open_position(timestamp, signal, bar_index)
+            # 记录权益曲线，未平仓仓位按收盘价计入浮动盈亏
+            equity = self.balance
+            for position in self.positions:
+                equity += (row['Close'] - position['entry_price']) * position['size'] - position['entry_fee']
+                if self.cost_model:
+                    equity -= float(self.cost_model.funding_cost(
+                        position['entry_index'], bar_index, position['entry_price'] * position['size']))
+            equity_balances[bar_index] = equity
+        self.equity_curve.extend(equity_timestamps, equity_balances)
+
+        BACKTEST_RUNS.inc()
+        BACKTEST_BARS.inc(len(data))
+        BACKTEST_TRADES.inc(sum(1 for t in self.trades[trades_before:] if t['type'] == 'SELL'))
+        BACKTEST_SECONDS.observe(time.perf_counter() - start)
         return self.generate_report()
 
     def generate_report(self):
@@ -149,18 +211,15 @@ class Backtester:
                 'max_drawdown': 0
             }
 
-        # 计算交易统计
-        profitable_trades = [t for t in self.trades if t.get('profit', 0) > 0]
-        losing_trades = [t for t in self.trades if t.get('profit', 0) < 0]
+        # 计算交易统计（只统计已平仓的 SELL 记录）
+        closed_trades = [t for t in self.trades if t['type'] == 'SELL']
+        profitable_trades = [t for t in closed_trades if t['profit'] > 0]
+        losing_trades = [t for t in closed_trades if t['profit'] < 0]
 
         # 计算最大回撤
-        peak = self.initial_balance
-        max_drawdown = 0
-        for point in self.equity_curve:
-            if point['balance'] > peak:
-                peak = point['balance']
-            drawdown = (peak - point['balance']) / peak * 100
-            max_drawdown = max(max_drawdown, drawdown)
+        _, balances = analytics.equity_to_arrays(self.equity_curve)
+        drawdown = analytics.drawdown_series(balances, self.initial_balance)
+        max_drawdown = float(drawdown.max()) if len(drawdown) else 0
 
         # 计算平均盈利和平均亏损
         avg_profit = sum(t['profit'] for t in profitable_trades) / len(profitable_trades) if profitable_trades else 0
@@ -173,13 +232,23 @@ class Backtester:
             'initial_balance': self.initial_balance,
             'final_balance': self.balance,
             'total_return': ((self.balance - self.initial_balance) / self.initial_balance) * 100,
-            'total_trades': len(self.trades) // 2,  # 买入和卖出算一次交易
+            'total_trades': len(closed_trades),
             'profitable_trades': len(profitable_trades),
             'losing_trades': len(losing_trades),
-            'win_rate': len(profitable_trades) / len(self.trades) * 100 if self.trades else 0,
+            'win_rate': len(profitable_trades) / len(closed_trades) * 100 if closed_trades else 0,
             'average_profit': avg_profit,
             'average_loss': avg_loss,
             'profit_factor': profit_factor,
             'max_drawdown': max_drawdown,
-            'equity_curve': self.equity_curve
+            'equity_curve': list(self.equity_curve)
         }
+
+    def performance_report(self, **kwargs):
+        """
+        生成完整绩效报告（夏普、索提诺、卡玛、持仓占比、换手率等）
+        :param kwargs: 透传给 analytics.build_report 的参数
+        :return: dict
+        """
+        timestamps, balances = analytics.equity_to_arrays(self.equity_curve)
+        return analytics.build_report(timestamps, balances, self.trades,
+                                      initial_balance=self.initial_balance, **kwargs)
@@ -0,0 +1,246 @@
+from collections import deque
+
+import numpy as np
+
+from .analytics import to_seconds
+
+# OKX 永续合约资金费结算间隔：8 小时
+FUNDING_INTERVAL = 8 * 60 * 60
+# OKX 按近 30 天成交额划分费率档位
+FEE_VOLUME_WINDOW = 30 * 24 * 60 * 60
+
+
+class FeeSchedule:
+    """
+    阶梯手续费，按近 window 秒的滚动成交额（USDT）确定费率档位。
+    只需固定档位时，tiers 传入单个档位即可。
+    """
+
+    def __init__(self, tiers=((0, 0.0002, 0.0005),), window=FEE_VOLUME_WINDOW, base_volume=0.0):
+        """
+        :param tiers: [(滚动成交额下限, maker 费率, taker 费率), ...]，按成交额升序排列。
+                      默认为 OKX 永续合约普通用户费率（maker 0.02%，taker 0.05%）
+        :param window: 滚动成交额窗口（秒），默认 30 天
+        :param base_volume: 回测之外的账户滚动成交额，计入档位判断
+        """
+        self.window = window
+        self.base_volume = base_volume
+        tiers = sorted(tiers)
+        self.thresholds = np.array([t[0] for t in tiers], dtype=np.float64)
+        self.maker = np.array([t[1] for t in tiers], dtype=np.float64)
+        self.taker = np.array([t[2] for t in tiers], dtype=np.float64)
+
+    def rate(self, volume, maker=False):
+        """
+        查询费率，volume 与 maker 可为标量或数组
+        :param volume: 成交前窗口内的滚动成交额（不含 base_volume）
+        :param maker: 是否为挂单成交
+        """
+        tier = np.searchsorted(self.thresholds, np.asarray(volume) + self.base_volume, side='right') - 1
+        tier = np.maximum(tier, 0)
+        return np.where(maker, self.maker[tier], self.taker[tier])
+
+
+class FixedSlippage:
+    """
+    固定滑点（基点）
+    """
+
+    def __init__(self, bps=0):
+        self.fraction = bps / 10000
+
+    def prepare(self, data):
+        pass
+
+    def slippage(self, index, notional):
+        return self.fraction + np.zeros_like(notional, dtype=np.float64)
+
+
+class VolatilitySlippage:
+    """
+    基于波动率的滑点：k * (High - Low) / Close
+    """
+
+    def __init__(self, k=0.1):
+        self.k = k
+        self.fractions = None
+
+    def prepare(self, data):
+        self.fractions = (self.k * (data['High'] - data['Low']) / data['Close']).to_numpy(dtype=np.float64)
+
+    def slippage(self, index, notional):
+        return self.fractions[index] + np.zeros_like(notional, dtype=np.float64)
+
+
+class DepthSlippage:
+    """
+    基于订单簿深度的滑点：impact * 成交额 / 深度
+    """
+
+    def __init__(self, depth=None, depth_column=None, impact=1.0):
+        """
+        :param depth: 固定的盘口深度（USDT），与 depth_column 二选一
+        :param depth_column: 数据中记录每根 K 线盘口深度的列名
+        :param impact: 冲击系数
+        """
+        if depth is None and not depth_column:
+            raise ValueError("DepthSlippage requires depth or depth_column")
+        self.depth = depth
+        self.depth_column = depth_column
+        self.impact = impact
+        self.depths = None
+
+    def prepare(self, data):
+        if self.depth_column:
+            self.depths = data[self.depth_column].to_numpy(dtype=np.float64)
+        else:
+            self.depths = np.full(len(data), self.depth, dtype=np.float64)
+
+    def slippage(self, index, notional):
+        return self.impact * np.asarray(notional, dtype=np.float64) / self.depths[index]
+
+
+class FundingSchedule:
+    """
+    永续合约资金费。做多在正费率时支付，负费率时收取
+    """
+
+    def __init__(self, rate=0.0001, rates=None, interval=FUNDING_INTERVAL):
+        """
+        :param rate: 固定资金费率（每个结算周期）
+        :param rates: Series, 索引为结算时间（datetime 或毫秒时间戳），值为当期资金费率；提供时忽略 rate
+        :param interval: 固定费率下的结算间隔（秒）
+        """
+        self.rate = rate
+        self.rates = rates
+        self.interval = interval
+        self.cumulative = None
+
+    def prepare(self, data):
+        """
+        预先计算每根 K 线时点的累计资金费率，持仓期间的费用即为两端之差
+        """
+        seconds = to_seconds(data['Timestamp'])
+        if self.rates is None:
+            self.cumulative = np.floor(seconds / self.interval) * self.rate
+            return
+        rates = self.rates.sort_index()
+        settle = to_seconds(rates.index)
+        cumulative = np.concatenate(([0.0], np.cumsum(rates.to_numpy(dtype=np.float64))))
+        self.cumulative = cumulative[np.searchsorted(settle, seconds, side='right')]
+
+    def funding(self, entry_index, exit_index, notional):
+        return notional * (self.cumulative[exit_index] - self.cumulative[entry_index])
+
+
+class CostModel:
+    """
+    交易成本模型：手续费 + 滑点 + 资金费。
+    prepare() 在回测开始时对整段数据做一次向量化预计算，之后每笔成交只需数组查表；
+    同一套接口既可传入标量（逐行回测），也可传入数组（批量回测）。
+    """
+
+    def __init__(self, fees=None, slippage=None, funding=None):
+        """
+        :param fees: FeeSchedule，None 表示不收手续费
+        :param slippage: FixedSlippage / VolatilitySlippage / DepthSlippage，None 表示无滑点
+        :param funding: FundingSchedule，None 表示不计资金费（现货）
+        """
+        self.fees = fees
+        self.slippage = slippage
+        self.funding = funding
+        self.seconds = None
+        self._fills = deque()  # 窗口内的 (成交时间, 成交额)
+        self._window_volume = 0.0
+
+    def prepare(self, data):
+        """
+        :param data: DataFrame, 回测所用数据（已经过 strategy.prepare_data）
+        """
+        self._fills.clear()
+        self._window_volume = 0.0
+        self.seconds = to_seconds(data['Timestamp']) if self.fees else None
+        if self.slippage:
+            self.slippage.prepare(data)
+        if self.funding:
+            self.funding.prepare(data)
+
+    def fill_price(self, index, price, size, side):
+        """
+        计算含滑点的成交价
+        :param side: 1 为买入，-1 为卖出
+        """
+        if not self.slippage:
+            return price
+        return price * (1 + side * self.slippage.slippage(index, price * size))
+
+    def fee(self, notional, index, maker=False):
+        """
+        按成交前的滚动成交额计算手续费，并登记本次成交
+        :param index: 成交所在 K 线位置，用于滚动窗口
+        :param maker: 是否为挂单成交
+        """
+        if not self.fees:
+            return 0.0
+        if index is None or self.seconds is None:
+            raise ValueError("CostModel.fee requires a bar index after prepare()")
+        now = self.seconds[index]
+        # 移出窗口外的成交
+        while self._fills and self._fills[0][0] <= now - self.fees.window:
+            self._window_volume -= self._fills.popleft()[1]
+        fee = notional * float(self.fees.rate(self._window_volume, maker))
+        self._fills.append((now, notional))
+        self._window_volume += notional
+        return fee
+
+    def funding_cost(self, entry_index, exit_index, notional):
+        """
+        持仓期间的资金费
+        """
+        if not self.funding:
+            return 0.0
+        return self.funding.funding(entry_index, exit_index, notional)
+
+    def apply(self, entry_index, exit_index, entry_price, exit_price, size, entry_maker=False, exit_maker=False):
+        """
+        批量计算一组交易的成本，适用于向量化回测引擎。不会改动逐行回测的滚动成交额状态
+        :param entry_index: 开仓 K 线位置数组
+        :param exit_index: 平仓 K 线位置数组
+        :param entry_price: 开仓信号价格数组
+        :param exit_price: 平仓信号价格数组
+        :param size: 头寸大小数组
+        :param entry_maker: 开仓是否为挂单成交（标量或数组）
+        :param exit_maker: 平仓是否为挂单成交（标量或数组）
+        :return: dict, 包含成交价、手续费、资金费和净盈亏数组
+        """
+        entry_index = np.asarray(entry_index)
+        exit_index = np.asarray(exit_index)
+        size = np.asarray(size, dtype=np.float64)
+        entry_fill = self.fill_price(entry_index, np.asarray(entry_price, dtype=np.float64), size, 1)
+        exit_fill = self.fill_price(exit_index, np.asarray(exit_price, dtype=np.float64), size, -1)
+
+        entry_notional = entry_fill * size
+        exit_notional = exit_fill * size
+        if self.fees:
+            # 所有成交按时间排序，用前缀和 + searchsorted 求每笔成交前窗口内的滚动成交额
+            notionals = np.column_stack((entry_notional, exit_notional)).ravel()
+            times = np.column_stack((self.seconds[entry_index], self.seconds[exit_index])).ravel()
+            makers = np.column_stack(np.broadcast_arrays(entry_maker, exit_maker, size)[:2]).ravel()
+            order = np.argsort(times, kind='stable')
+            cumulative = np.concatenate(([0.0], np.cumsum(notionals[order])))
+            window_start = np.searchsorted(times[order], times[order] - self.fees.window, side='right')
+            volume_before = cumulative[:-1] - cumulative[window_start]
+            rates = np.empty_like(notionals)
+            rates[order] = self.fees.rate(volume_before, makers[order])
+            fees = (notionals * rates).reshape(-1, 2).sum(axis=1)
+        else:
+            fees = np.zeros_like(size)
+        funding = self.funding.funding(entry_index, exit_index, entry_notional) if self.funding else np.zeros_like(size)
+
+        return {
+            'entry_fill': entry_fill,
+            'exit_fill': exit_fill,
+            'fee': fees,
+            'funding': funding,
+            'profit': (exit_fill - entry_fill) * size - fees - funding,
+        }
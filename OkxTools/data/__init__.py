@@ -1,3 +1,4 @@
 from .kline_fetcher import get_klines, fetch_past_klines, fetch_all_instruments
 from .order_book import fetch_order_book
 from .ticker import fetch_ticker
+from .candle_cache import CandleCache, CandleBlock, CandleCacheClient, serve_candle_cache, connect_candle_cache
@@ -0,0 +1,415 @@
+import os
+import threading
+from collections import OrderedDict
+from multiprocessing import resource_tracker, shared_memory
+from multiprocessing.managers import BaseManager
+
+import numpy as np
+import pandas as pd
+
+# 默认缓存上限：1 GB
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+# 挂载时会临时替换 resource_tracker.register，与本模块创建共享内存互斥，避免新建的段漏登记
+_TRACKER_LOCK = threading.Lock()
+
+
+def _attach_shared_memory(name):
+    """
+    以只挂载的方式打开已存在的共享内存段，不让当前进程的 resource_tracker 接管其生命周期。
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 没有 track 参数，挂载时临时跳过登记，避免进程退出时误删共享内存
+        with _TRACKER_LOCK:
+            register = resource_tracker.register
+            resource_tracker.register = lambda *args, **kwargs: None
+            try:
+                return shared_memory.SharedMemory(name=name)
+            finally:
+                resource_tracker.register = register
+
+
+class CandleView:
+    """
+    共享内存中 K 线数据的零拷贝视图
+    """
+
+    def __init__(self, shm, shape, columns):
+        self._shm = shm
+        self.columns = columns
+        self.array = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        self.array.flags.writeable = False
+
+    def column(self, name):
+        """
+        按列名取出一列（仍为零拷贝视图）
+        :param name: 列名，例如 'Close'
+        :return: ndarray
+        """
+        return self.array[:, self.columns.index(name)]
+
+    def to_frame(self):
+        """
+        转换为 DataFrame，便于直接交给 Backtester 使用（会复制一份数据）
+        """
+        return pd.DataFrame(self.array, columns=list(self.columns))
+
+    def close(self):
+        """
+        断开与共享内存的连接。调用前需确保外部不再持有 array 及其切片。
+        """
+        if self._shm is not None:
+            self.array = None
+            self._shm.close()
+            self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class CandleBlock:
+    """
+    缓存条目的描述信息，可被 pickle 后发送给其他进程，由其自行挂载
+    """
+
+    def __init__(self, inst_id, bar, shm_name, shape, columns):
+        self.inst_id = inst_id
+        self.bar = bar
+        self.shm_name = shm_name
+        self.shape = tuple(shape)
+        self.columns = tuple(columns)
+
+    @property
+    def nbytes(self):
+        return self.shape[0] * self.shape[1] * np.dtype(np.float64).itemsize
+
+    def open(self):
+        """
+        挂载共享内存并返回零拷贝视图
+        :return: CandleView
+        """
+        return CandleView(_attach_shared_memory(self.shm_name), self.shape, self.columns)
+
+
+class CandleCache:
+    """
+    基于 multiprocessing.shared_memory 的 K 线缓存。
+    每个 (inst_id, bar) 只从 CSV 读取一次；引用按客户端（默认为进程 pid）登记，
+    无人引用的条目在超过内存上限时按 LRU 淘汰，已退出进程持有的引用会被自动回收。
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, data_dir="data/csv"):
+        """
+        :param max_bytes: 共享内存总占用上限（字节）
+        :param data_dir: K 线 CSV 文件所在目录
+        """
+        self.max_bytes = max_bytes
+        self.data_dir = data_dir
+        self.total_bytes = 0
+        self._entries = OrderedDict()  # key -> {'shm', 'block', 'holders': {client_id: count}}
+        self._loading = {}  # key -> threading.Event，正在从 CSV 加载的条目
+        self._lock = threading.Lock()
+
+    def _csv_path(self, inst_id, bar):
+        return os.path.join(self.data_dir, f"{inst_id}_{bar}_klines_past.csv")
+
+    def _reap_dead_clients(self):
+        """
+        回收已退出进程（崩溃或忘记 release）持有的引用
+        """
+        alive = {}
+        for entry in self._entries.values():
+            for client_id in list(entry['holders']):
+                if not isinstance(client_id, int):
+                    continue
+                if client_id not in alive:
+                    alive[client_id] = _pid_alive(client_id)
+                if not alive[client_id]:
+                    del entry['holders'][client_id]
+
+    def _evict(self, required_bytes):
+        """
+        淘汰最久未使用且未被引用的条目，直到能容纳 required_bytes
+        """
+        if self.total_bytes + required_bytes > self.max_bytes:
+            self._reap_dead_clients()
+        for key in list(self._entries):
+            if self.total_bytes + required_bytes <= self.max_bytes:
+                break
+            if self._entries[key]['holders']:
+                continue
+            self._drop(key)
+        return self.total_bytes + required_bytes <= self.max_bytes
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self.total_bytes -= entry['block'].nbytes
+        entry['shm'].close()
+        entry['shm'].unlink()
+
+    def _insert(self, inst_id, bar, csv_file, data):
+        """
+        将已读取的数据写入共享内存，需在持有锁时调用
+        """
+        values = data.to_numpy(dtype=np.float64)
+        if not self._evict(values.nbytes):
+            raise MemoryError(
+                f"Candle cache is full ({self.total_bytes}/{self.max_bytes} bytes in use), "
+                f"cannot load {inst_id}-{bar} ({values.nbytes} bytes)"
+            )
+        with _TRACKER_LOCK:
+            shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+        np.ndarray(values.shape, dtype=np.float64, buffer=shm.buf)[:] = values
+        block = CandleBlock(inst_id, bar, shm.name, values.shape, data.columns)
+        self.total_bytes += block.nbytes
+        entry = {'shm': shm, 'block': block, 'csv_file': csv_file, 'holders': {}}
+        self._entries[(inst_id, bar)] = entry
+        return entry
+
+    def _hold(self, key, entry, client_id):
+        self._entries.move_to_end(key)
+        entry['holders'][client_id] = entry['holders'].get(client_id, 0) + 1
+        return entry['block']
+
+    def acquire(self, inst_id, bar, csv_file=None, client_id=None):
+        """
+        获取 K 线数据的共享内存描述，首次访问时从 CSV 加载，并为 client_id 登记一次引用。
+        读取 CSV 时不持有锁，其他条目的 acquire / release 不会被阻塞。
+        :param inst_id: 交易对，例如 'BTC-USDT-SWAP'
+        :param bar: K 线周期，例如 '1D'
+        :param csv_file: CSV 文件路径，默认 data/csv/{inst_id}_{bar}_klines_past.csv；
+                         与已缓存条目的来源文件不一致时抛出 ValueError
+        :param client_id: 引用持有者，默认为当前进程 pid；通过服务访问时由 CandleCacheClient 传入
+        :return: CandleBlock
+        """
+        key = (inst_id, bar)
+        csv_file = os.path.abspath(csv_file or self._csv_path(inst_id, bar))
+        if client_id is None:
+            client_id = os.getpid()
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    if entry['csv_file'] != csv_file:
+                        raise ValueError(
+                            f"{inst_id}-{bar} is cached from {entry['csv_file']}, not {csv_file}; "
+                            f"invalidate it before loading another file"
+                        )
+                    return self._hold(key, entry, client_id)
+                event = self._loading.get(key)
+                if event is None:
+                    event = threading.Event()
+                    self._loading[key] = event
+                    break
+            # 其他线程正在加载同一条目，等待完成后重试
+            event.wait()
+
+        try:
+            data = pd.read_csv(csv_file)
+            with self._lock:
+                return self._hold(key, self._insert(inst_id, bar, csv_file, data), client_id)
+        finally:
+            with self._lock:
+                del self._loading[key]
+            event.set()
+
+    def lease(self, inst_id, bar, csv_file=None):
+        """
+        :return: CandleLease, 用法: with cache.lease(inst_id, bar) as lease: ...
+        """
+        return CandleLease(self, inst_id, bar, csv_file)
+
+    def release(self, inst_id, bar, client_id=None):
+        """
+        释放 client_id 的一次引用，计数归零后条目仍保留，直到因内存上限被淘汰
+        """
+        if client_id is None:
+            client_id = os.getpid()
+        with self._lock:
+            entry = self._entries.get((inst_id, bar))
+            if entry is None or client_id not in entry['holders']:
+                return
+            entry['holders'][client_id] -= 1
+            if entry['holders'][client_id] <= 0:
+                del entry['holders'][client_id]
+
+    def release_client(self, client_id):
+        """
+        释放某个客户端持有的全部引用，用于客户端断开或退出时清理
+        """
+        with self._lock:
+            for entry in self._entries.values():
+                entry['holders'].pop(client_id, None)
+
+    def invalidate(self, inst_id, bar):
+        """
+        CSV 更新后丢弃旧数据，下次 acquire 时重新加载
+        :return: bool, 是否已丢弃（仍被引用时不会丢弃）
+        """
+        with self._lock:
+            entry = self._entries.get((inst_id, bar))
+            if entry is None or entry['holders']:
+                return False
+            self._drop((inst_id, bar))
+            return True
+
+    def stats(self):
+        """
+        返回缓存占用情况
+        """
+        with self._lock:
+            return {
+                'max_bytes': self.max_bytes,
+                'total_bytes': self.total_bytes,
+                'entries': [
+                    {
+                        'inst_id': entry['block'].inst_id,
+                        'bar': entry['block'].bar,
+                        'nbytes': entry['block'].nbytes,
+                        'refcount': sum(entry['holders'].values()),
+                        'holders': dict(entry['holders']),
+                    }
+                    for entry in self._entries.values()
+                ],
+            }
+
+    def close(self):
+        """
+        释放并删除所有共享内存段
+        """
+        with self._lock:
+            for key in list(self._entries):
+                self._drop(key)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class CandleLease:
+    """
+    acquire 得到的租约，退出 with 块时自动 release
+    """
+
+    def __init__(self, cache, inst_id, bar, csv_file=None):
+        self._cache = cache
+        self.block = cache.acquire(inst_id, bar, csv_file)
+
+    def open(self):
+        return self.block.open()
+
+    def release(self):
+        if self.block is not None:
+            self._cache.release(self.block.inst_id, self.block.bar)
+            self.block = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+class CandleCacheClient:
+    """
+    K 线缓存服务的客户端，自动以当前进程 pid 登记引用，close() 时释放本进程持有的全部引用
+    """
+
+    def __init__(self, proxy):
+        self._proxy = proxy
+        self.client_id = os.getpid()
+
+    def acquire(self, inst_id, bar, csv_file=None):
+        return self._proxy.acquire(inst_id, bar, csv_file, self.client_id)
+
+    def release(self, inst_id, bar):
+        self._proxy.release(inst_id, bar, self.client_id)
+
+    def lease(self, inst_id, bar, csv_file=None):
+        """
+        :return: CandleLease, 用法: with client.lease(inst_id, bar) as lease: ...
+        """
+        return CandleLease(self, inst_id, bar, csv_file)
+
+    def invalidate(self, inst_id, bar):
+        return self._proxy.invalidate(inst_id, bar)
+
+    def stats(self):
+        return self._proxy.stats()
+
+    def close(self):
+        self._proxy.release_client(self.client_id)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class CandleCacheManager(BaseManager):
+    """
+    将 CandleCache 作为本地服务暴露给其他进程
+    """
+
+
+_server_cache = None
+
+
+def _get_server_cache():
+    return _server_cache
+
+
+CandleCacheManager.register("get_cache", callable=_get_server_cache)
+
+
+def serve_candle_cache(authkey, address=("127.0.0.1", 50055), max_bytes=DEFAULT_MAX_BYTES, data_dir="data/csv"):
+    """
+    在当前进程启动 K 线缓存服务（阻塞运行）
+    :param authkey: 连接认证密钥（bytes），服务基于 pickle 通信，必须使用不可猜测的随机值，
+                    例如 os.urandom(32)，再通过环境变量等方式传给工作进程
+    :param address: 监听地址
+    :param max_bytes: 共享内存总占用上限（字节）
+    :param data_dir: K 线 CSV 文件所在目录
+    """
+    global _server_cache
+    if not authkey:
+        raise ValueError("authkey is required")
+    _server_cache = CandleCache(max_bytes=max_bytes, data_dir=data_dir)
+    manager = CandleCacheManager(address=address, authkey=authkey)
+    server = manager.get_server()
+    print(f"Candle cache serving on {address[0]}:{address[1]}")
+    try:
+        server.serve_forever()
+    finally:
+        _server_cache.close()
+
+
+def connect_candle_cache(authkey, address=("127.0.0.1", 50055)):
+    """
+    连接到已启动的 K 线缓存服务
+    :param authkey: 与 serve_candle_cache 相同的认证密钥
+    :return: CandleCacheClient
+    """
+    if not authkey:
+        raise ValueError("authkey is required")
+    manager = CandleCacheManager(address=address, authkey=authkey)
+    manager.connect()
+    return CandleCacheClient(manager.get_cache())
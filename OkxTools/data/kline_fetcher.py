@@ -3,12 +3,26 @@ import json
 import time
 from tqdm import tqdm
 import os
+import shutil
+import numpy as np
 import pandas as pd
 
+from ..utils.metrics import REGISTRY
+from .rest import _instrumented_get
+
 # REST API 地址
 KLINE_URL = "https://www.okx.com/api/v5/market/history-candles"
 INSTRUMENTS_URL = "https://www.okx.com/api/v5/public/instruments"
 
+# K 线 CSV 列名
+KLINE_COLUMNS = ["Timestamp", "Open", "High", "Low", "Close", "Volume1", "Volume2", "Volume3", "f"]
+
+# 回填进度指标
+BACKFILL_ROWS = REGISTRY.counter("okx_backfill_rows_total", "K-line rows fetched by fetch_past_klines",
+                                 ("inst_id", "bar"))
+BACKFILL_CHUNKS = REGISTRY.counter("okx_backfill_chunks_flushed_total", "K-line chunks flushed to disk",
+                                   ("inst_id", "bar"))
+
 # 创建数据目录
 if not os.path.exists('data/csv'):
     os.makedirs('data/csv')
@@ -30,22 +44,7 @@ def get_klines(inst_id, bar, limit=100, before=None, after=None, retries=5, back
     if after:
         params["after"] = str(after)
 
-    for attempt in range(retries):
-        try:
-            response = requests.get(KLINE_URL, params=params, timeout=10)
-            response.raise_for_status()
-            json_data = response.json()
-
-            if json_data['code'] != '0':
-                print(f"Error from API: {json_data['msg']}")
-                return None
-
-            return json_data["data"]
-        except requests.exceptions.RequestException as e:
-            print(f"Request error: {e}. Retrying {attempt + 1}/{retries}...")
-            time.sleep(backoff * (attempt + 1))  # 指数退避
-    print("Max retries exceeded. Could not fetch data.")
-    return None
+    return _instrumented_get("candles", KLINE_URL, params, retries, backoff)
 
 
 def fetch_all_instruments(inst_type="SPOT"):
@@ -80,81 +79,225 @@ def fetch_all_instruments(inst_type="SPOT"):
 
 def fetch_existing_data(csv_file):
     """
-    检查 CSV 文件中已有数据，并返回最新的时间戳
+    检查 CSV 文件中已有数据，并返回最新的时间戳（只读取 Timestamp 列）
     """
     if not os.path.exists(csv_file):
-        return None, []
+        return None
 
     try:
-        data = pd.read_csv(csv_file, dtype={'Timestamp': int})
+        data = pd.read_csv(csv_file, usecols=["Timestamp"], dtype={'Timestamp': int})
         if data.empty:
-            return None, []
+            return None
 
         # 获取最新的时间戳
-        last_timestamp = data["Timestamp"].max()
-        return last_timestamp, data.values.tolist()
+        return int(data["Timestamp"].max())
     except Exception as e:
         print(f"Error reading existing data: {e}")
-        return None, []
+        return None
+
+
+def load_checkpoint(checkpoint_file):
+    """
+    读取断点文件，不存在或损坏时返回 None
+    """
+    if not os.path.exists(checkpoint_file):
+        return None
+    try:
+        with open(checkpoint_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Error reading checkpoint: {e}")
+        return None
+
+
+def save_checkpoint(checkpoint_file, checkpoint):
+    """
+    原子写入断点文件，避免中途崩溃留下半个文件
+    """
+    tmp_file = checkpoint_file + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_file, checkpoint_file)
+
+
+def flush_klines(rows, parts_dir, part_no):
+    """
+    将一批 K 线写入分片文件
+    :return: 分片文件路径
+    """
+    df = pd.DataFrame([[float(item) for item in row] for row in rows], columns=KLINE_COLUMNS)
+    df["Timestamp"] = df["Timestamp"].astype(int)
+    part_file = os.path.join(parts_dir, f"part_{part_no:06d}.csv")
+    df.to_csv(part_file + ".tmp", index=False)
+    os.replace(part_file + ".tmp", part_file)
+    return part_file
+
+
+def _write_descending(df, out, last_written):
+    """
+    只写出时间戳严格小于此前已写出行的数据，去掉重复或乱序的行
+    :return: 写出后最小的时间戳
+    """
+    timestamps = df["Timestamp"].to_numpy()
+    if len(timestamps) == 0:
+        return last_written
+    previous = np.minimum.accumulate(np.concatenate(([last_written], timestamps[:-1])))
+    keep = timestamps < previous
+    df[keep].to_csv(out, index=False, header=False)
+    return min(last_written, timestamps[keep].min()) if keep.any() else last_written
+
+
+def _is_descending(csv_file, chunk_size):
+    """
+    逐块检查 CSV 的时间戳是否按降序排列（允许重复，重复行合并时会被去掉）
+    """
+    previous = np.inf
+    for chunk in pd.read_csv(csv_file, usecols=["Timestamp"], chunksize=chunk_size):
+        timestamps = chunk["Timestamp"].to_numpy()
+        if len(timestamps) == 0:
+            continue
+        if timestamps[0] > previous or np.any(np.diff(timestamps) > 0):
+            return False
+        previous = timestamps[-1]
+    return True
+
+
+def merge_klines(csv_file, tmp_file, parts_dir, part_count, stop_timestamp, chunk_size):
+    """
+    按时间降序依次合并分片文件和已有 CSV 写入 tmp_file，逐块读写，内存占用与数据总量无关。
+    已有 CSV 若不是降序（例如手动整理过的升序文件），先整体读入排序再合并，避免丢失历史数据
+    """
+    last_written = np.inf
+    with open(tmp_file, "w", encoding="utf-8", newline="") as out:
+        out.write(",".join(KLINE_COLUMNS) + "\n")
+        for part_no in range(part_count):
+            df = pd.read_csv(os.path.join(parts_dir, f"part_{part_no:06d}.csv"))
+            # 丢弃与已有数据重叠的部分，重叠时间段以已有数据为准
+            if stop_timestamp is not None:
+                df = df[df["Timestamp"] > stop_timestamp]
+            last_written = _write_descending(df, out, last_written)
+        if stop_timestamp is not None and os.path.exists(csv_file):
+            if _is_descending(csv_file, chunk_size):
+                chunks = pd.read_csv(csv_file, chunksize=chunk_size)
+            else:
+                print(f"\n{csv_file} is not sorted newest-first, sorting it in memory before merging...")
+                chunks = [pd.read_csv(csv_file).sort_values("Timestamp", ascending=False, kind="stable")]
+            for chunk in chunks:
+                last_written = _write_descending(chunk, out, last_written)
+
+
+def finish_backfill(csv_file, checkpoint_file, parts_dir):
+    """
+    完成合并后的收尾：替换 CSV、删除分片和断点。
+    调用前断点已原子地标记为 merged，任何一步崩溃后重新调用都能安全地继续，不会重复合并
+    """
+    tmp_file = csv_file + ".tmp"
+    if os.path.exists(tmp_file):
+        os.replace(tmp_file, csv_file)
+    if os.path.exists(parts_dir):
+        shutil.rmtree(parts_dir)
+    if os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
 
 
-def fetch_past_klines(inst_id, bar, csv_file):
+def fetch_past_klines(inst_id, bar, csv_file, chunk_size=10000):
     """
-    从当前时间向过去获取所有历史 K 线数据，并保存到 CSV 文件
+    从当前时间向过去获取所有历史 K 线数据，并保存到 CSV 文件。
+    已获取的数据每满 chunk_size 条写入一次分片文件，并在 {csv_file}.checkpoint.json 中记录游标；
+    中途失败后重新调用即可从最后一次落盘的位置继续。
     """
-    # 检查现有数据
-    last_existing_timestamp, existing_data = fetch_existing_data(csv_file)
-    all_data = []
-    total_records = 0  # 用于统计总数据条数
+    checkpoint_file = csv_file + ".checkpoint.json"
+    parts_dir = csv_file + ".parts"
+    checkpoint = load_checkpoint(checkpoint_file)
+
+    if checkpoint and checkpoint.get("inst_id") == inst_id and checkpoint.get("bar") == bar:
+        if checkpoint.get("phase") == "merged":
+            # 上次已完成合并，只差收尾
+            finish_backfill(csv_file, checkpoint_file, parts_dir)
+            print(f"Data saved to {csv_file}")
+            return
+        print(f"Resuming from checkpoint: after={checkpoint['cursor']}, {checkpoint['total_records']} records saved")
+    else:
+        # 检查现有数据
+        last_existing_timestamp = fetch_existing_data(csv_file)
+        if last_existing_timestamp and time.time() * 1000 - last_existing_timestamp < 1000 * 60 * 60 * 24:
+            print("\nRequested data is older than existing data. Stopping...")
+            return
+        if os.path.exists(parts_dir):
+            shutil.rmtree(parts_dir)
+        checkpoint = {
+            "inst_id": inst_id,
+            "bar": bar,
+            "cursor": None,
+            "stop_timestamp": last_existing_timestamp,
+            "phase": "fetching",
+            "parts": 0,
+            "total_records": 0,
+        }
+    os.makedirs(parts_dir, exist_ok=True)
+
+    last_existing_timestamp = checkpoint["stop_timestamp"]
+    start_after = checkpoint["cursor"]
+    total_records = checkpoint["total_records"]  # 用于统计总数据条数
+    buffer = []
+    rows_metric = BACKFILL_ROWS.labels(inst_id, bar)
+
+    def flush():
+        if buffer:
+            flush_klines(buffer, parts_dir, checkpoint["parts"])
+            BACKFILL_CHUNKS.labels(inst_id, bar).inc()
+            checkpoint["parts"] += 1
+            buffer.clear()
+        checkpoint["cursor"] = start_after
+        checkpoint["total_records"] = total_records
+        save_checkpoint(checkpoint_file, checkpoint)
 
     # 使用 tqdm 显示进度条
-    with tqdm(desc=f"Fetching ***{inst_id}-{bar}*** historical data", unit="records", leave=True) as pbar:
-        start_after = None
+    with tqdm(desc=f"Fetching ***{inst_id}-{bar}*** historical data", unit="records", leave=True,
+              initial=total_records) as pbar:
         while True:
-            if last_existing_timestamp and time.time() * 1000 - last_existing_timestamp < 1000 * 60 * 60 * 24:
-                print("\nRequested data is older than existing data. Stopping...")
-                break
             # 调用 API 获取数据
             data = get_klines(inst_id, bar, limit=100, after=start_after)
+            if data is None:
+                flush()
+                print(f"\nError occurred. Progress saved to {checkpoint_file}, run again to resume.")
+                return
             if not data:
-                print("\nNo more data available or error occurred.")
+                print("\nNo more data available.")
                 break
 
             # 更新进度条
             pbar.update(len(data))
+            rows_metric.inc(len(data))
             pbar.set_postfix(total=total_records)
 
-            # 将新数据添加到 all_data 列表
-            all_data.extend(data)
+            # 将新数据添加到缓冲区
+            buffer.extend(data)
+            total_records += len(data)
+            start_after = int(data[-1][0])  # 更新最后时间戳
             # 如果请求的数据早于现有数据的时间戳，停止
-            if last_existing_timestamp and int(data[-1][0]) <= last_existing_timestamp:
+            if last_existing_timestamp and start_after <= last_existing_timestamp:
                 print("\nRequested data is older than existing data. Stopping...")
                 break
-            total_records += len(data)
-            start_after = int(data[-1][0])  # 更新最后时间戳
 
             # 如果返回的数据量不足100，说明已经获取到最早的记录
             if len(data) < 100:
                 print("\nReached the earliest available data.")
                 break
 
+            # 缓冲区达到上限时落盘
+            if len(buffer) >= chunk_size:
+                flush()
+
             # 避免频繁请求
             time.sleep(0.1)
-    # 转换为浮点数嵌套列表
-    all_data = [[float(item) for item in sublist] for sublist in all_data]
-    # 合并现有数据和新数据
-    combined_data = existing_data + all_data
-    # 将 combined_data 转换为 pandas DataFrame
-    df = pd.DataFrame(
-        combined_data,
-        columns=["Timestamp", "Open", "High", "Low", "Close", "Volume1", "Volume2", "Volume3", "f"],
-    )
-    # 根据 'Timestamp' 列去重（保留最新的）
-    df.drop_duplicates(subset=["Timestamp"], inplace=True)
-    df["Timestamp"] = df["Timestamp"].astype(int)
-    # 对 DataFrame 按 "Volume" 列降序排序
-    df = df.sort_values(by="Timestamp", ascending=False)
-    df.to_csv(csv_file, index=False)
+    flush()
+
+    # 合并分片与现有数据，先写临时文件，标记断点为 merged 后再替换
+    merge_klines(csv_file, csv_file + ".tmp", parts_dir, checkpoint["parts"], last_existing_timestamp, chunk_size)
+    checkpoint["phase"] = "merged"
+    save_checkpoint(checkpoint_file, checkpoint)
+    finish_backfill(csv_file, checkpoint_file, parts_dir)
     print(f"Data saved to {csv_file}")
 
 
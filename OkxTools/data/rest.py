@@ -0,0 +1,53 @@
+import time
+
+import requests
+
+from ..utils.metrics import REGISTRY
+
+# OKX REST 请求指标，由 data 模块中的各个接口共用
+REQUESTS = REGISTRY.counter("okx_requests_total", "OKX REST requests sent", ("endpoint",))
+REQUEST_ERRORS = REGISTRY.counter("okx_request_errors_total", "OKX REST request errors", ("endpoint", "kind"))
+REQUEST_RETRIES = REGISTRY.counter("okx_request_retries_total", "OKX REST request retries", ("endpoint",))
+REQUEST_LATENCY = REGISTRY.histogram("okx_request_latency_seconds", "OKX REST request latency",
+                                     ("endpoint", "outcome"))
+
+
+def _instrumented_get(endpoint, url, params, retries=5, backoff=2, what="data"):
+    """
+    带重试的 GET 请求，记录请求数、错误、重试次数和延迟
+    :param endpoint: 指标中的 endpoint 标签，例如 'candles'
+    :param what: 重试耗尽时提示信息中的数据名称
+    :return: 接口返回的 data 字段，失败时返回 None
+    """
+    for attempt in range(retries):
+        REQUESTS.labels(endpoint).inc()
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            response = requests.get(url, params=params, timeout=10)
+            response.raise_for_status()
+            json_data = response.json()
+
+            if json_data['code'] != '0':
+                outcome = "api_error"
+                REQUEST_ERRORS.labels(endpoint, "api").inc()
+                print(f"Error from API: {json_data['msg']}")
+                return None
+
+            outcome = "ok"
+            return json_data["data"]
+        except requests.exceptions.RequestException as e:
+            REQUEST_ERRORS.labels(endpoint, "request").inc()
+            if attempt + 1 < retries:
+                REQUEST_RETRIES.labels(endpoint).inc()
+            print(f"Request error: {e}. Retrying {attempt + 1}/{retries}...")
+        except Exception:
+            REQUEST_ERRORS.labels(endpoint, "other").inc()
+            raise
+        finally:
+            # 超时、连接失败等异常同样计入延迟
+            REQUEST_LATENCY.labels(endpoint, outcome).observe(time.perf_counter() - start)
+        time.sleep(backoff * (attempt + 1))  # 指数退避
+    REQUEST_ERRORS.labels(endpoint, "retries_exhausted").inc()
+    print(f"Max retries exceeded. Could not fetch {what}.")
+    return None
@@ -1,3 +1,4 @@
 from .logger import setup_logger
 from .data_utils import normalize_data
 from .time_utils import timestamp_to_datetime
+from .metrics import REGISTRY, MetricsRegistry, Counter, Histogram, start_metrics_server
@@ -1,26 +1,257 @@
-from OkxTools.backtest.backtester import Backtester
-from OkxTools.strategy.ema_crossover import EMACrossoverStrategy
+import json
+import os
+
+import numpy as np
 import pandas as pd
+import pytest
+
+from OkxTools.backtest import (Backtester, CostModel, DepthSlippage, FeeSchedule, FixedSlippage, FundingSchedule,
+                               VolatilitySlippage, analytics)
+from OkxTools.strategy.macd_strategy import MACDStrategy
+
+CSV_FILE = os.path.join(os.path.dirname(__file__), "data", "csv", "BTC-USDT-SWAP_1D_klines_past.csv")
+DAY = 24 * 60 * 60
+HOUR = 60 * 60
+START = 1700006400  # 2023-11-15 00:00 UTC，恰为资金费结算时点
+
+
+def make_data(closes, step=DAY):
+    """
+    按时间正序生成毫秒时间戳的 K 线，与 OKX CSV 的 Timestamp 格式一致
+    """
+    timestamps = (START + np.arange(len(closes)) * step) * 1000
+    closes = np.asarray(closes, dtype=np.float64)
+    return pd.DataFrame({"Timestamp": timestamps, "Open": closes, "High": closes, "Low": closes, "Close": closes})
+
+
+class ScriptedStrategy:
+    """
+    按 K 线位置给出预设信号：'long' 开仓，'exit' 平仓
+    """
+
+    def __init__(self, actions, **signal):
+        self.actions = actions
+        self.signal = signal
+        self.bar = -1
+
+    def prepare_data(self, data):
+        return data
+
+    def on_data(self, row):
+        self.bar += 1
+        action = self.actions.get(self.bar)
+        if action == "long":
+            return [dict({"type": "long", "price": row["Close"], "stop_loss": row["Close"] / 2,
+                          "take_profit": row["Close"] * 10}, **self.signal)]
+        if action == "exit":
+            return [dict({"type": "exit", "price": row["Close"]}, **self.signal)]
+        return []
+
+
+def test_performance_report_on_raw_csv():
+    # CSV 保持 OKX 原始格式：毫秒时间戳、按时间倒序
+    data = pd.read_csv(CSV_FILE)
+    backtester = Backtester()
+    report = backtester.run(data, MACDStrategy())
+    json.dumps(report)
+    assert isinstance(report["equity_curve"], list)
+    assert report["equity_curve"][0]["timestamp"] == data["Timestamp"].min() / 1000
+
+    performance = backtester.performance_report(drawdown_window=30)
+    assert performance["total_trades"] == report["total_trades"] > 0
+    assert not performance["period_returns"].isna().any()
+    assert performance["period_returns"].index.year.min() >= 2019
+    assert performance["average_trade_duration"] > 0
+    for key in ("sharpe_ratio", "sortino_ratio", "calmar_ratio", "exposure"):
+        assert np.isfinite(performance[key]) and performance[key] != 0
+
+
+def test_win_rate_counts_closed_trades_only():
+    data = make_data([100, 110, 110, 100, 100, 120, 120, 130])
+    strategy = ScriptedStrategy({0: "long", 1: "exit", 2: "long", 3: "exit", 4: "long", 5: "exit", 6: "long"})
+    backtester = Backtester()
+    report = backtester.run(data, strategy)
+
+    # 两盈一亏，最后一笔仍未平仓，不计入交易次数
+    assert len(backtester.trades) == 7
+    assert report["total_trades"] == 3
+    assert report["profitable_trades"] == 2
+    assert report["losing_trades"] == 1
+    assert report["win_rate"] == pytest.approx(200 / 3)
+
+    performance = backtester.performance_report()
+    assert performance["total_trades"] == 3
+    assert performance["win_rate"] == pytest.approx(200 / 3)
+    # 持仓区间 [0, 1), [2, 3), [4, 5) 以及最后两根 K 线
+    assert performance["exposure"] == pytest.approx(5 / 8 * 100)
+
+
+def test_equity_marks_open_positions_to_market():
+    data = make_data([100, 100, 110, 120, 90])
+    backtester = Backtester()
+    backtester.run(data, ScriptedStrategy({1: "long"}))
+
+    # 头寸 = 10000 * 0.02 / 50 = 4
+    _, balances = analytics.equity_to_arrays(backtester.equity_curve)
+    np.testing.assert_allclose(balances, [10000, 10000, 10040, 10080, 9960])
+    assert backtester.balance == 10000
+    assert backtester.performance_report()["max_drawdown"] == pytest.approx(120 / 10080 * 100)
+
+
+def test_to_seconds_units():
+    np.testing.assert_allclose(analytics.to_seconds(pd.Series([1700006400000, 1700092800000])),
+                               [1700006400, 1700092800])
+    np.testing.assert_allclose(analytics.to_seconds(pd.Series([1700006400]), unit="s"), [1700006400])
+    np.testing.assert_allclose(analytics.to_seconds(pd.Series(["2023-11-15"])), [1700006400])
+
+
+def test_sharpe_and_sortino_known_values():
+    returns = np.array([0.01, -0.01, 0.02, 0.0])
+    # 均值 0.005，样本方差 5e-4 / 3；下行偏差 sqrt(0.01^2 / 4) = 0.005
+    assert analytics.sharpe_ratio(returns, 252) == pytest.approx(0.005 / np.sqrt(5e-4 / 3) * np.sqrt(252))
+    assert analytics.sortino_ratio(returns, 252) == pytest.approx(np.sqrt(252))
+    assert analytics.sharpe_ratio(np.full(5, 0.01), 252) == 0.0
+    assert analytics.sortino_ratio(np.full(5, 0.01), 252) == 0.0
+
+
+def test_drawdown_known_values():
+    balances = np.array([100.0, 120.0, 90.0, 130.0, 117.0])
+    np.testing.assert_allclose(analytics.drawdown_series(balances, 100), [0, 0, 25, 0, 10])
+    np.testing.assert_allclose(analytics.drawdown_series(balances, 150),
+                               [100 / 3, 20, 40, 40 / 3, 22])
+    np.testing.assert_allclose(analytics.rolling_drawdown(balances, 2), [0, 0, 25, 0, 10])
+    np.testing.assert_allclose(analytics.rolling_drawdown(np.array([100.0, 90.0, 80.0, 70.0]), 2),
+                               [0, 10, 100 / 9, 12.5])
+
+
+@pytest.mark.parametrize("window", [1, 2, 3, 7, 50, 200])
+def test_rolling_max_matches_pandas(window):
+    values = np.random.default_rng(window).normal(size=101).cumsum()
+    expected = pd.Series(values).rolling(window, min_periods=1).max().to_numpy()
+    np.testing.assert_allclose(analytics.rolling_max(values, window), expected)
+
+
+def test_calmar_ratio_uses_initial_balance():
+    # 一年 252 个周期，从初始资金 100 增长到 121
+    balances = np.linspace(110, 121, 253)
+    assert analytics.calmar_ratio(balances, 252, 10, initial_balance=100) == pytest.approx(2.1)
+    assert analytics.calmar_ratio(balances, 252, 10) == pytest.approx(1.0)
+
+
+def test_position_mask_with_open_positions():
+    timestamps = np.arange(10, dtype=np.float64)
+    mask = analytics.position_mask(timestamps, np.array([1.0, 5.0]), np.array([3.0, 7.0]), np.array([8.0]))
+    assert np.flatnonzero(mask).tolist() == [1, 2, 5, 6, 8, 9]
+    assert not analytics.position_mask(timestamps, np.empty(0), np.empty(0)).any()
+    assert analytics.position_mask(timestamps, np.empty(0), np.empty(0), np.array([0.0])).all()
+
+
+def closed_trade_indices(data, trades):
+    """
+    由 SELL 记录的开平仓时间反查 K 线位置
+    """
+    position = {t: i for i, t in enumerate(data["Timestamp"])}
+    closed = [t for t in trades if t["type"] == "SELL"]
+    return (np.array([position[t["entry_time"]] for t in closed]),
+            np.array([position[t["exit_time"]] for t in closed]), closed)
+
+
+def test_cost_model_batch_matches_row_loop():
+    rng = np.random.default_rng(7)
+    closes = 100 * np.exp(rng.normal(0, 0.02, 200).cumsum())
+    data = make_data(closes, step=HOUR)
+    data["High"] = data["Close"] * 1.01
+    data["Low"] = data["Close"] * 0.99
+    actions = {}
+    for start in range(0, 190, 6):
+        actions[start], actions[start + 4] = "long", "exit"
+    tiers = ((0, 0.0002, 0.0005), (1000, 0.00015, 0.0004), (3000, 0.0001, 0.0003))
+    cost_model = CostModel(FeeSchedule(tiers, window=DAY), VolatilitySlippage(0.1), FundingSchedule(0.0001))
+    backtester = Backtester(cost_model=cost_model)
+    backtester.run(data, ScriptedStrategy(actions, maker=True))
+
+    entry_index, exit_index, closed = closed_trade_indices(data, backtester.trades)
+    assert len(closed) == 32
+    batch = cost_model.apply(entry_index, exit_index, closes[entry_index], closes[exit_index],
+                             [t["size"] for t in closed], entry_maker=True, exit_maker=True)
+    np.testing.assert_allclose(batch["entry_fill"], [t["entry_price"] for t in closed])
+    np.testing.assert_allclose(batch["exit_fill"], [t["exit_price"] for t in closed])
+    np.testing.assert_allclose(batch["fee"], [t["fee"] for t in closed])
+    np.testing.assert_allclose(batch["funding"], [t["funding"] for t in closed])
+    np.testing.assert_allclose(batch["profit"], [t["profit"] for t in closed])
+    # 成交额累计后会进入更低的费率档位
+    assert len(np.unique(np.round(batch["fee"] / (batch["entry_fill"] + batch["exit_fill"])
+                                  / np.array([t["size"] for t in closed]), 8))) > 1
+
+
+def test_fee_tier_follows_rolling_30_day_volume():
+    cost_model = CostModel(FeeSchedule(((0, 0.0002, 0.0005), (1e6, 0.0001, 0.0003))))
+    cost_model.prepare(make_data(np.full(40, 100.0)))
+
+    assert cost_model.fee(1e6, 0) == pytest.approx(500)
+    # 第 29 天仍在 30 天窗口内，按第二档收费
+    assert cost_model.fee(1000, 29) == pytest.approx(0.3)
+    # 第 30 天时第 0 天的成交移出窗口，回到第一档
+    assert cost_model.fee(1000, 30) == pytest.approx(0.5)
+
+    # 批量计算得到相同的档位变化
+    cost_model.prepare(make_data(np.full(40, 1e6)))
+    batch = cost_model.apply([0, 29], [0, 30], [1e6, 1e6], [1e6, 1e6], [1, 0.001])
+    np.testing.assert_allclose(batch["fee"], [1e6 * 0.0005 + 1e6 * 0.0003, 1000 * 0.0003 + 1000 * 0.0005])
+
+
+def test_maker_and_taker_rates():
+    cost_model = CostModel(FeeSchedule(base_volume=0.0))
+    cost_model.prepare(make_data(np.full(3, 100.0)))
+    assert cost_model.fee(1000, 0, maker=True) == pytest.approx(0.2)
+    assert cost_model.fee(1000, 1, maker=False) == pytest.approx(0.5)
+    batch = cost_model.apply([0, 0], [1, 1], [100, 100], [100, 100], [10, 10],
+                             entry_maker=np.array([True, False]), exit_maker=False)
+    np.testing.assert_allclose(batch["fee"], [0.2 + 0.5, 0.5 + 0.5])
+
+    # 回测中由信号的 maker / take_profit_maker 决定费率
+    data = make_data([100, 100, 100, 100])
+    backtester = Backtester(cost_model=CostModel(FeeSchedule()))
+    backtester.run(data, ScriptedStrategy({0: "long", 2: "exit"}, maker=True))
+    buy, sell = backtester.trades
+    assert buy["fee"] == pytest.approx(buy["entry_price"] * buy["size"] * 0.0002)
+    assert sell["fee"] == pytest.approx(buy["entry_price"] * buy["size"] * 0.0004)
+
+
+@pytest.mark.parametrize("entry, exit, periods", [(0, 7, 0), (1, 8, 1), (0, 8, 1), (7, 17, 2), (3, 40, 5)])
+def test_funding_across_8h_boundaries(entry, exit, periods):
+    data = make_data(np.full(48, 100.0), step=HOUR)
+    cost_model = CostModel(funding=FundingSchedule(0.0001))
+    cost_model.prepare(data)
+    assert cost_model.funding_cost(entry, exit, 1000) == pytest.approx(periods * 0.1)
 
-# 加载 CSV 数据
-csv_file = "data/csv/BTC-USDT-SWAP_1D_klines_past.csv"  # 替换为你的实际文件路径
-data = pd.read_csv(csv_file)
 
-# 检查并重命名列，确保与回测框架兼容
-data.columns = ["Timestamp", "Open", "High", "Low", "Close", "Volume1", "Volume2", "Volume3", "f"]
-data = data[["Timestamp", "Open", "High", "Low", "Close"]]  # 保留必要的列
+def test_funding_with_rate_series():
+    data = make_data(np.full(48, 100.0), step=HOUR)
+    settle = (START + np.array([8, 16, 24]) * HOUR) * 1000
+    cost_model = CostModel(funding=FundingSchedule(rates=pd.Series([0.0001, -0.0003, 0.0002], index=settle)))
+    cost_model.prepare(data)
+    assert cost_model.funding_cost(1, 8, 1000) == pytest.approx(0.1)
+    assert cost_model.funding_cost(1, 20, 1000) == pytest.approx(-0.2)
+    assert cost_model.funding_cost(9, 30, 1000) == pytest.approx(-0.1)
 
-# 确保时间戳格式正确
-data["Timestamp"] = pd.to_datetime(data["Timestamp"])
 
-# 计算短期和长期 EMA
-data["EMA_Short"] = data["Close"].ewm(span=10, adjust=False).mean()
-data["EMA_Long"] = data["Close"].ewm(span=50, adjust=False).mean()
+def test_cost_model_requires_bar_index():
+    backtester = Backtester(cost_model=CostModel(FeeSchedule(), FixedSlippage(5)))
+    backtester.cost_model.prepare(make_data([100, 100]))
+    signal = {"type": "long", "price": 100, "stop_loss": 50, "take_profit": 1000}
+    with pytest.raises(ValueError, match="bar_index"):
+        backtester.open_position(START * 1000, signal)
+    backtester.open_position(START * 1000, signal, bar_index=0)
+    with pytest.raises(ValueError, match="bar_index"):
+        backtester.close_position(START * 1000, backtester.positions[0], 100)
+    with pytest.raises(ValueError):
+        backtester.cost_model.fee(1000, None)
 
-# 初始化策略和回测
-strategy = EMACrossoverStrategy(short_window=10, long_window=50)
-backtester = Backtester(strategy=strategy, data=data)
 
-# 运行回测并生成报告
-report = backtester.run()
-print(report)
+def test_depth_slippage_requires_depth():
+    with pytest.raises(ValueError):
+        DepthSlippage()
+    slippage = DepthSlippage(depth=1e6, impact=0.5)
+    slippage.prepare(make_data([100, 100]))
+    assert slippage.slippage(1, 2e4) == pytest.approx(0.01)
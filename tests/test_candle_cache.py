@@ -0,0 +1,165 @@
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from OkxTools.data import candle_cache
+from OkxTools.data.candle_cache import CandleCache, CandleCacheClient
+
+COLUMNS = ["Timestamp", "Open", "High", "Low", "Close"]
+
+
+def write_csv(path, rows=10, start=0):
+    df = pd.DataFrame(np.arange(start, start + rows * len(COLUMNS), dtype=np.float64).reshape(rows, len(COLUMNS)),
+                      columns=COLUMNS)
+    df.to_csv(path, index=False)
+    return df
+
+
+@pytest.fixture
+def cache(tmp_path):
+    for inst_id in ("A", "B", "C"):
+        write_csv(tmp_path / f"{inst_id}_1D_klines_past.csv")
+    cache = CandleCache(data_dir=str(tmp_path))
+    yield cache
+    cache.close()
+
+
+def count_reads(monkeypatch):
+    reads = []
+    read_csv = pd.read_csv
+
+    def counting_read_csv(path, *args, **kwargs):
+        reads.append(path)
+        return read_csv(path, *args, **kwargs)
+
+    monkeypatch.setattr(candle_cache.pd, "read_csv", counting_read_csv)
+    return reads
+
+
+def refcounts(cache):
+    return {(entry['inst_id'], entry['bar']): entry['holders'] for entry in cache.stats()['entries']}
+
+
+def test_acquire_loads_csv_once(cache, tmp_path, monkeypatch):
+    reads = count_reads(monkeypatch)
+    threads = [threading.Thread(target=cache.acquire, args=("A", "1D")) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    cache.acquire("A", "1D")
+
+    assert len(reads) == 1
+    expected = pd.read_csv(tmp_path / "A_1D_klines_past.csv")
+    with cache.acquire("A", "1D").open() as view:
+        assert view.to_frame().equals(expected)
+        assert not view.array.flags.writeable
+
+
+def test_refcounts_are_per_client(cache):
+    cache.acquire("A", "1D", client_id="w1")
+    cache.acquire("A", "1D", client_id="w1")
+    cache.acquire("A", "1D", client_id="w2")
+    assert refcounts(cache)[("A", "1D")] == {"w1": 2, "w2": 1}
+
+    # 其他客户端的 release 不会影响 w1 持有的引用
+    cache.release("A", "1D", client_id="w2")
+    cache.release("A", "1D", client_id="w2")
+    assert refcounts(cache)[("A", "1D")] == {"w1": 2}
+
+    cache.release_client("w1")
+    assert refcounts(cache)[("A", "1D")] == {}
+
+
+def test_lease_and_client_release_on_exit(cache):
+    with cache.lease("A", "1D") as lease:
+        assert sum(refcounts(cache)[("A", "1D")].values()) == 1
+        with lease.open() as view:
+            assert view.array.shape == (10, len(COLUMNS))
+    assert refcounts(cache)[("A", "1D")] == {}
+
+    # 客户端退出时释放本进程持有的全部引用
+    with CandleCacheClient(cache) as client:
+        client.acquire("A", "1D")
+        client.acquire("B", "1D")
+        client.acquire("B", "1D")
+    assert refcounts(cache) == {("A", "1D"): {}, ("B", "1D"): {}}
+
+
+def test_reaps_dead_clients(cache, monkeypatch):
+    entry_bytes = cache.acquire("A", "1D", client_id=99999).nbytes
+    cache.max_bytes = entry_bytes
+    monkeypatch.setattr(candle_cache, "_pid_alive", lambda pid: False)
+    cache.acquire("B", "1D")
+    assert list(refcounts(cache)) == [("B", "1D")]
+
+
+def test_lru_eviction_under_max_bytes(cache):
+    entry_bytes = cache.acquire("A", "1D", client_id="w").nbytes
+    cache.max_bytes = 2 * entry_bytes
+    cache.acquire("B", "1D", client_id="w")
+    cache.release("A", "1D", client_id="w")
+    cache.release("B", "1D", client_id="w")
+    # 访问 A 后 B 成为最久未使用的条目
+    cache.acquire("A", "1D", client_id="w")
+    cache.release("A", "1D", client_id="w")
+
+    cache.acquire("C", "1D", client_id="w")
+    assert list(refcounts(cache)) == [("A", "1D"), ("C", "1D")]
+    assert cache.total_bytes == 2 * entry_bytes
+
+
+def test_memory_error_when_all_entries_held(cache):
+    entry_bytes = cache.acquire("A", "1D", client_id="w").nbytes
+    cache.max_bytes = 2 * entry_bytes
+    cache.acquire("B", "1D", client_id="w")
+
+    with pytest.raises(MemoryError):
+        cache.acquire("C", "1D", client_id="w")
+    assert list(refcounts(cache)) == [("A", "1D"), ("B", "1D")]
+
+    # 失败的加载不会残留 loading 标记，释放引用后可以重新加载
+    cache.release("A", "1D", client_id="w")
+    cache.acquire("C", "1D", client_id="w")
+    assert list(refcounts(cache)) == [("B", "1D"), ("C", "1D")]
+
+
+def test_invalidate(cache, tmp_path, monkeypatch):
+    reads = count_reads(monkeypatch)
+    cache.acquire("A", "1D")
+    assert not cache.invalidate("A", "1D")  # 仍被引用
+
+    cache.release("A", "1D")
+    write_csv(tmp_path / "A_1D_klines_past.csv", rows=3, start=100)
+    assert cache.invalidate("A", "1D")
+    assert cache.total_bytes == 0
+    assert not cache.invalidate("A", "1D")
+
+    with cache.acquire("A", "1D").open() as view:
+        assert view.array.shape == (3, len(COLUMNS))
+        assert view.column("Timestamp").tolist() == [100.0, 105.0, 110.0]
+    assert len(reads) == 2
+
+
+def test_acquire_rejects_different_csv_file(cache, tmp_path):
+    other = tmp_path / "other.csv"
+    write_csv(other, rows=4)
+    cache.acquire("A", "1D")
+    # 显式传入与默认相同的路径时正常返回
+    cache.acquire("A", "1D", str(tmp_path / "A_1D_klines_past.csv"))
+
+    with pytest.raises(ValueError, match="invalidate"):
+        cache.acquire("A", "1D", str(other))
+
+    cache.release_client(candle_cache.os.getpid())
+    cache.invalidate("A", "1D")
+    assert cache.acquire("A", "1D", str(other)).shape == (4, len(COLUMNS))
+
+
+def test_authkey_is_required():
+    with pytest.raises(ValueError):
+        candle_cache.connect_candle_cache(b"")
+    with pytest.raises(ValueError):
+        candle_cache.serve_candle_cache(None)
@@ -1,8 +1,113 @@
+import os
+import time
+
+import pandas as pd
+import pytest
+
 from OkxTools import fetch_past_klines
+from OkxTools.data import kline_fetcher
+
+DAY = 24 * 60 * 60 * 1000
+
+
+def make_rows(count, newest):
+    """
+    生成按时间降序排列的 K 线，格式与 OKX 接口返回一致
+    """
+    return [[str(newest - i * DAY), "1", "2", "0.5", "1.5", "10", "11", "12", "1"] for i in range(count)]
+
+
+def fake_get_klines(rows, fail_on=()):
+    """
+    模拟 get_klines：按 after 游标分页，第 fail_on 次调用返回 None（重试耗尽）
+    """
+    calls = {"n": 0}
+
+    def get_klines(inst_id, bar, limit=100, before=None, after=None, **kwargs):
+        calls["n"] += 1
+        if calls["n"] in fail_on:
+            return None
+        page = [row for row in rows if after is None or int(row[0]) < after]
+        return page[:limit]
+
+    return get_klines
+
+
+def write_existing(csv_file, rows):
+    df = pd.DataFrame([[float(item) for item in row] for row in rows], columns=kline_fetcher.KLINE_COLUMNS)
+    df["Timestamp"] = df["Timestamp"].astype(int)
+    df.to_csv(csv_file, index=False)
+
+
+def assert_complete(csv_file, rows):
+    df = pd.read_csv(csv_file)
+    assert len(df) == len(rows)
+    assert df["Timestamp"].is_unique
+    assert df["Timestamp"].is_monotonic_decreasing
+    assert df["Timestamp"].tolist() == [int(row[0]) for row in rows]
+    assert not os.path.exists(csv_file + ".parts")
+    assert not os.path.exists(csv_file + ".checkpoint.json")
 
-if __name__ == "__main__":
-    import os
 
+def test_fetch_past_klines_resumes_and_merges(tmp_path, monkeypatch):
+    monkeypatch.setattr(kline_fetcher.time, "sleep", lambda seconds: None)
+    rows = make_rows(2550, int(time.time() * 1000) - 2 * DAY)
+    csv_file = str(tmp_path / "X-1D.csv")
+    # 已有最早的 500 条，需要增量补齐更新的数据
+    write_existing(csv_file, rows[2050:])
+
+    monkeypatch.setattr(kline_fetcher, "get_klines", fake_get_klines(rows, fail_on={9}))
+    fetch_past_klines("X", "1D", csv_file, chunk_size=300)
+    checkpoint = kline_fetcher.load_checkpoint(csv_file + ".checkpoint.json")
+    assert checkpoint["total_records"] == 800
+    assert len(pd.read_csv(csv_file)) == 500  # 失败时不改动已有 CSV
+
+    monkeypatch.setattr(kline_fetcher, "get_klines", fake_get_klines(rows))
+    fetch_past_klines("X", "1D", csv_file, chunk_size=300)
+    assert_complete(csv_file, rows)
+
+
+@pytest.mark.parametrize("order", ["ascending", "shuffled"])
+def test_fetch_past_klines_keeps_unsorted_history(tmp_path, monkeypatch, order):
+    monkeypatch.setattr(kline_fetcher.time, "sleep", lambda seconds: None)
+    rows = make_rows(450, int(time.time() * 1000) - 2 * DAY)
+    monkeypatch.setattr(kline_fetcher, "get_klines", fake_get_klines(rows))
+    csv_file = str(tmp_path / "X-1D.csv")
+    existing = rows[200:]
+    # 已有 CSV 不是按时间倒序保存，合并时不能丢掉任何历史数据
+    if order == "ascending":
+        existing = existing[::-1]
+    else:
+        existing = existing[1::2] + existing[::2]
+    write_existing(csv_file, existing)
+
+    fetch_past_klines("X", "1D", csv_file, chunk_size=100)
+    assert_complete(csv_file, rows)
+
+
+@pytest.mark.parametrize("step", ["rmtree", "remove"])
+def test_fetch_past_klines_crash_during_cleanup(tmp_path, monkeypatch, step):
+    monkeypatch.setattr(kline_fetcher.time, "sleep", lambda seconds: None)
+    rows = make_rows(450, int(time.time() * 1000) - 2 * DAY)
+    monkeypatch.setattr(kline_fetcher, "get_klines", fake_get_klines(rows))
+    csv_file = str(tmp_path / "X-1D.csv")
+    write_existing(csv_file, rows[300:])
+
+    # CSV 已替换，但在删除分片（rmtree）或删除断点（remove）时崩溃
+    def crash(path):
+        raise KeyboardInterrupt
+
+    with monkeypatch.context() as m:
+        m.setattr(kline_fetcher.shutil if step == "rmtree" else kline_fetcher.os, step, crash)
+        with pytest.raises(KeyboardInterrupt):
+            fetch_past_klines("X", "1D", csv_file, chunk_size=100)
+    assert os.path.exists(csv_file + ".checkpoint.json")
+
+    fetch_past_klines("X", "1D", csv_file, chunk_size=100)
+    assert_complete(csv_file, rows)
+
+
+if __name__ == "__main__":
     inst_id = "BTC-USDT-SWAP"
     bar = "1D"
     csv_file = os.path.join("data/csv", f"{inst_id}_{bar}_klines_past.csv")
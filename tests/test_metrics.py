@@ -0,0 +1,126 @@
+import urllib.error
+import urllib.request
+
+import pytest
+import requests
+
+from OkxTools.data import rest
+from OkxTools.utils.metrics import MetricsRegistry, start_metrics_server
+
+
+def test_counter_render_escapes_labels():
+    registry = MetricsRegistry()
+    counter = registry.counter("jobs_total", "Jobs run", ("name",))
+    counter.labels('a"b\\c\nd').inc()
+    counter.labels("plain").inc(2)
+    registry.counter("plain_total", "No labels").inc()
+
+    lines = registry.render().splitlines()
+    assert lines[:2] == ["# HELP jobs_total Jobs run", "# TYPE jobs_total counter"]
+    assert 'jobs_total{name="a\\"b\\\\c\\nd"} 1.0' in lines
+    assert 'jobs_total{name="plain"} 2.0' in lines
+    assert "plain_total 1.0" in lines
+    assert registry.counter("jobs_total", "Jobs run", ("name",)) is counter
+    with pytest.raises(ValueError):
+        registry.histogram("jobs_total", "Jobs run")
+    with pytest.raises(ValueError):
+        counter.labels("a", "b")
+
+
+def test_histogram_render_is_cumulative():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("latency_seconds", "Latency", ("endpoint",), buckets=(0.1, 1.0, 0.5))
+    child = histogram.labels("x")
+    for value in (0.05, 0.1, 0.3, 0.7, 2.0):
+        child.observe(value)
+
+    lines = registry.render().splitlines()
+    assert lines[1] == "# TYPE latency_seconds histogram"
+    assert lines[2:] == [
+        'latency_seconds_bucket{endpoint="x",le="0.1"} 2',
+        'latency_seconds_bucket{endpoint="x",le="0.5"} 3',
+        'latency_seconds_bucket{endpoint="x",le="1.0"} 4',
+        'latency_seconds_bucket{endpoint="x",le="+Inf"} 5',
+        'latency_seconds_sum{endpoint="x"} 3.15',
+        'latency_seconds_count{endpoint="x"} 5',
+    ]
+
+
+def test_histogram_quantile():
+    registry = MetricsRegistry()
+    child = registry.histogram("q_seconds", "Quantiles", buckets=(1.0, 2.0, 4.0)).labels()
+    assert child.quantile(0.5) == 0.0
+    for value in (0.5, 1.5, 1.5, 3.0):
+        child.observe(value)
+    # 桶内线性插值：rank 2 落在 (1, 2] 桶的中点
+    assert child.quantile(0.5) == pytest.approx(1.5)
+    assert child.quantile(0.25) == pytest.approx(1.0)
+    assert child.quantile(1.0) == pytest.approx(4.0)
+    child.observe(10.0)
+    assert child.quantile(1.0) == 4.0  # 落在 +Inf 桶时返回最大的有限边界
+
+
+def test_metrics_server_serves_registry():
+    registry = MetricsRegistry()
+    registry.counter("served_total", "Served").inc(3)
+    server = start_metrics_server(port=0, registry=registry)
+    try:
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+        with urllib.request.urlopen(base + "/metrics", timeout=5) as response:
+            assert response.status == 200
+            assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+            assert "served_total 3.0" in response.read().decode("utf-8").splitlines()
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(base + "/other", timeout=5)
+        assert error.value.code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class FakeResponse:
+    def __init__(self, payload):
+        self.payload = payload
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.payload
+
+
+def test_instrumented_get_records_retries_and_latency(monkeypatch):
+    monkeypatch.setattr(rest.time, "sleep", lambda seconds: None)
+    responses = [requests.exceptions.ConnectionError("down"), FakeResponse({"code": "0", "data": [1]})]
+
+    def fake_get(url, params=None, timeout=None):
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    monkeypatch.setattr(rest.requests, "get", fake_get)
+    requests_before = rest.REQUESTS.labels("test").value
+    retries_before = rest.REQUEST_RETRIES.labels("test").value
+    errors_before = rest.REQUEST_ERRORS.labels("test", "request").value
+    failed_before = rest.REQUEST_LATENCY.labels("test", "error").count
+    ok_before = rest.REQUEST_LATENCY.labels("test", "ok").count
+
+    assert rest._instrumented_get("test", "http://okx.invalid", {}) == [1]
+    assert rest.REQUESTS.labels("test").value == requests_before + 2
+    assert rest.REQUEST_RETRIES.labels("test").value == retries_before + 1
+    assert rest.REQUEST_ERRORS.labels("test", "request").value == errors_before + 1
+    # 连接失败的请求同样计入延迟
+    assert rest.REQUEST_LATENCY.labels("test", "error").count == failed_before + 1
+    assert rest.REQUEST_LATENCY.labels("test", "ok").count == ok_before + 1
+
+
+def test_instrumented_get_counts_unexpected_errors(monkeypatch):
+    def fake_get(url, params=None, timeout=None):
+        return FakeResponse({"unexpected": True})
+
+    monkeypatch.setattr(rest.requests, "get", fake_get)
+    before = rest.REQUEST_ERRORS.labels("test", "other").value
+    with pytest.raises(KeyError):
+        rest._instrumented_get("test", "http://okx.invalid", {})
+    assert rest.REQUEST_ERRORS.labels("test", "other").value == before + 1